@@ -0,0 +1,4 @@
+import logging
+
+# Leave it to applications whether and where to emit the logs of this package
+logging.getLogger(__name__).addHandler(logging.NullHandler())
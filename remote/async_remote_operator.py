@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import shlex
+from pathlib import Path
+import asyncssh
+from .remote_operator import RemoteOperator
+
+log = logging.getLogger(__name__)
+
+
+class AsyncRemoteOperator:
+    """ This class provides the remote operations of `RemoteOperator` as coroutines.
+
+    Initialize with `asyncssh.SSHClientConnection` to run commands on a remote host.
+    Independent operations, such as the same operation on many hosts, can be overlapped
+    with `asyncio.gather` instead of waiting for the round-trips of each in turn.
+
+    Usage:
+        async def deploy(hosts):
+            connections = await asyncio.gather(*(asyncssh.connect(host) for host in hosts))
+            operators = [AsyncRemoteOperator(c) for c in connections]
+            await asyncio.gather(*(op.backup('/app', '/backup/app') for op in operators))
+            await asyncio.gather(*(op.upload(Path('dist/app'), '/') for op in operators))
+
+        asyncio.run(deploy(['web1', 'web2']))
+
+    """
+
+    def __init__(self, connection, concurrency: int = 8):
+        """ Constructor.
+
+        Args:
+            connection (SSHClientConnection): A connection to a remote host
+            concurrency (int)               : The number of files to be uploaded at the same time
+        """
+
+        if not (isinstance(concurrency, int) and concurrency > 0):
+            raise ValueError('concurrency must be a positive integer.')
+
+        self.connection = connection
+        self.concurrency = concurrency
+
+    _q = staticmethod(RemoteOperator._q)
+
+    async def run(self, command: str, **kwargs):
+        """Runs a command on a remote host.
+
+        Args:
+            command (str): A shell command to be run on host
+            **kwargs     : See `asyncssh.SSHClientConnection.run` for details on the available keyword arguments
+
+        Returns:
+            SSHCompletedProcess: The result of the command, which does not raise an error if failed
+
+        """
+
+        return await self.connection.run(command, check=False, **kwargs)
+
+    async def mkdir(self, remote_path: str):
+        """Creates a directory on a remote host.
+
+        Args:
+            remote_path (str) : A path of directory to be created on host
+
+        Raises:
+            ValueError: If an argument is invalid
+            OSError   : If failed to create a directory
+
+        """
+
+        if not (isinstance(remote_path, str) or remote_path):
+            raise ValueError('remote_path must be string and not be None or empty.')
+
+        q_remote_path = self._q(remote_path)
+        command = f'test -e {q_remote_path} || mkdir -pv {q_remote_path}'
+        result = await self.run(command)
+        if result.exit_status != 0:
+            raise OSError(f'Failed to create directory by command: {command}')
+        if result.stdout:
+            log.info('Directory is created by command: %s', command)
+
+    async def backup(self, path_from: str, path_to: str):
+        """Backs up an application.
+
+        First create a backup directory with the specified 'path_to'.
+        Then copies files from the specified 'path_from' to the backup directory.
+
+        Args:
+            path_from (str) : A path of flies to be backed up
+            path_to (str)   : A path of directory to back up the files to
+
+        Raises:
+            ValueError: If an argument is invalid
+            OSError   : If failed to create a directory
+
+        """
+
+        if not (isinstance(path_from, str) or path_from):
+            raise ValueError('path_from must be string and not be None or empty.')
+        if not (isinstance(path_to, str) or path_to):
+            raise ValueError('path_to must be string and not be None or empty.')
+        result = await self.run(f'test -e {self._q(path_from)}')
+        if result.exit_status != 0:
+            # Not to miss backing up files, raise an error if path does not exist
+            raise ValueError(f'path_from does exist on host, path: {path_from}')
+
+        # Create a backup directory
+        await self.mkdir(path_to)
+
+        # Copy files to the backup directory
+        log.info('Backing up ...')
+        command = f'cp -pr {self._q(path_from)} {self._q(path_to)}'
+        result = await self.run(command)
+        if result.exit_status != 0:
+            raise OSError(f'Failed to back up file(s) by command: {command}')
+        log.info('Backed up files by command: %s', command)
+
+    async def upload(self, local_path: Path, remote_path: str):
+        """Uploads a file or directory.
+
+        If local_path is a directory, create the directory on host,
+        else put a file on host.
+        The children of a directory are uploaded at the same time, up to `concurrency` files.
+
+        Args:
+            local_path (Path) : A Path object of directory or file to be created on remote host
+            remote_path (str) : An absolute path of directory on remote host
+
+        Raises:
+            TypeError : If type of argument is invalid
+            ValueError: If invalid arguments are specified
+            OSError   : If any remote operations failed
+
+        """
+
+        # Validate arguments
+        if not isinstance(local_path, Path):
+            raise TypeError('Type of local_path must be pathlib.Path')
+        if not (isinstance(remote_path, str) or remote_path):
+            raise ValueError('remote_path must be string and not be None or empty.')
+        result = await self.run(f'test -d {self._q(remote_path)}')
+        if result.exit_status != 0:
+            raise OSError(f'Remote path does not exists or is not a directory, path: {remote_path}.')
+
+        # Made in the running loop, since it is bound to the loop made at the time on Python 3.8 and 3.9
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # One SFTP session serves all of the concurrent requests
+        async with self.connection.start_sftp_client() as sftp:
+            await self._upload(sftp, semaphore, local_path, remote_path)
+
+    async def _upload(self, sftp, semaphore: asyncio.Semaphore, local_path: Path, remote_path: str):
+        remote = f'{remote_path}/{local_path.name}'
+        if local_path.is_dir():
+            # Through the SFTP session, not to open an exec channel per directory beyond MaxSessions of sshd
+            try:
+                await sftp.makedirs(remote, exist_ok=True)
+            except asyncssh.SFTPError as e:
+                raise OSError(f'Failed to create directory, path: {remote}') from e
+            log.debug('Created directory %s', remote)
+            await asyncio.gather(*(self._upload(sftp, semaphore, p, remote) for p in local_path.iterdir()))
+        else:
+            async with semaphore:
+                await sftp.put(str(local_path.absolute()), remote, preserve=True)
+            log.debug('Uploaded %s to %s', local_path.absolute(), remote)
+
+    async def _count_processes(self, process_name_pattern: str):
+        # Given through stdin, the pattern is not in the command line of the shell for `pgrep -f` to find
+        script = f'pgrep -cf {shlex.quote(process_name_pattern)}\nexit $?\n'
+        result = await self.run('sh -s', input=script)
+        if result.exit_status not in (0, 1):  # => 1 means no process found
+            raise OSError(f'Failed to find processes by pattern: {process_name_pattern}')
+        return int(result.stdout.strip() or 0)
+
+    async def _wait_for_processes(self, process_name_pattern: str, running: bool, timeout: int = 60):
+        # The clock of the loop is monotonic, so a jump of the system time does not move the deadline
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = 0.05
+        while bool(await self._count_processes(process_name_pattern)) != running:
+            if loop.time() >= deadline:
+                return False
+            # Back off exponentially, so a process which stops or starts quickly is noticed soon
+            await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+            delay = min(delay * 2, 1.0)
+        return True
+
+    async def stop_process_with_kill_file(
+            self,
+            to_be_created_kill_file_path: str,
+            process_name_pattern: str,
+            remote_timeout: int = 60,
+    ):
+        """Stops an application.
+
+        This method is to stop the application which manages its process with a file.
+
+        Process:
+        1) If the application already stopped, does nothing and exits this method.
+        2) Creates a kill file under the specified path.
+        3) Confirms that the application has stopped.
+           It will be timed-out after `remote_timeout` seconds.
+
+        Args:
+            to_be_created_kill_file_path (str): A path of a kill file which will be created
+            process_name_pattern (str)        : A pattern of an app process name to grep system processes with
+            remote_timeout (int)              : Seconds to wait for the application to stop
+
+        """
+
+        # Check if application has been running
+        if not await self._count_processes(process_name_pattern):
+            log.info('Application has not been running, pattern: %s', process_name_pattern)
+            log.info('Skip stopping process')
+            return
+
+        # Stop the process by creating a kill file
+        command = f'touch {self._q(to_be_created_kill_file_path)}'
+        result = await self.run(command)
+        if result.exit_status != 0:
+            raise OSError(f'Failed to create a kill file by command: {command}')
+
+        # Confirm that application stopped
+        if not await self._wait_for_processes(process_name_pattern, running=False, timeout=remote_timeout):
+            raise OSError(
+                f'Process could not be stopped within {remote_timeout} seconds, Please check the server spec.'
+            )
+        log.info('Confirmed that the application has stopped, pattern: %s', process_name_pattern)
+
+    async def start_process_with_kill_file(
+            self,
+            to_be_removed_kill_file_path: str,
+            process_name_pattern: str,
+            exec_file_path: str,
+            remote_timeout: int = 60,
+    ):
+        """Starts an application.
+
+        This method is to start the application which manages its process with a file.
+
+        Process:
+        1) If the application has already been running, does nothing and exits this method.
+        2) Removes a kill file
+        3) Runs an execution file of an application.
+        4) Confirms that the application has started.
+           It will be timed-out after `remote_timeout` seconds.
+
+        Args:
+            to_be_removed_kill_file_path (str): A path of a kill file which will be removed
+            process_name_pattern (str)        : A pattern of an app process name to grep system processes with
+            exec_file_path (str)              : A path of an execution file of application
+            remote_timeout (int)              : Seconds to wait for the application to start
+
+        """
+
+        # Check if application has been running
+        if await self._count_processes(process_name_pattern):
+            log.info('Application has already been running, pattern: %s', process_name_pattern)
+            log.info('Skip starting process')
+            return
+
+        # Remove the kill file
+        q_kill_file_path = self._q(to_be_removed_kill_file_path)
+        result = await self.run(f'rm -v {q_kill_file_path}')
+        if result.exit_status != 0:
+            if (await self.run(f'test -e {q_kill_file_path}')).exit_status == 0:
+                raise OSError(f'Failed to remove the kill file by command: {to_be_removed_kill_file_path}')
+            log.info('Kill file did not exist, path: %s', to_be_removed_kill_file_path)
+            log.info('Skip removing the kill file')
+
+        # Start the application
+        log.info('Staring the application ...')
+        command = f'nohup sh {self._q(exec_file_path)} >/dev/null 2>&1 &'
+        result = await self.run(command)
+        if result.exit_status != 0:
+            raise OSError(f'Failed to start the application by command: {command}')
+
+        # Confirm that the application is running
+        log.debug('Waiting for the application to start ...')
+        if not await self._wait_for_processes(process_name_pattern, running=True, timeout=remote_timeout):
+            raise OSError(
+                f'Process could not be started within {remote_timeout} seconds, Please check the server spec.'
+            )
+        log.info('Confirmed that the application has started, pattern: %s', process_name_pattern)
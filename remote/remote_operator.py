@@ -1,25 +1,371 @@
+import collections
 import contextlib
-import time
-from fabric import Connection
+import functools
+import io
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING
+from .ssh_pool import SSHPool
+
+if TYPE_CHECKING:
+    # fabric pulls in invoke, paramiko and cryptography, so it is imported when a connection is made
+    from fabric import Connection
+    from paramiko import SFTPClient
+
+log = logging.getLogger(__name__)
+
+# A result of each command run by `RemoteOperator.run_many`
+CommandResult = collections.namedtuple('CommandResult', ['command', 'exited', 'stdout'])
 
 
 class RemoteOperator:
     """ This class provides useful functions for remote operation.
 
-    Initialize with `fabric.connection.Connection` to run commands
-    on a remote host.
+    Initialize with `fabric.connection.Connection`, a callable returning it, or `SSHPool`
+    to run commands on a remote host. Every command reuses a connection checked out from the pool.
+    The callable is not called until the first command runs.
 
     """
 
-    def __init__(self, connection):
+    # A home directory prefix, which a shell expands only if it is not quoted
+    _tilde_prefix = re.compile(r'~[\w.-]*', re.ASCII)
+    # Bytes of the paths given to one `mkdir -p`, far below ARG_MAX of any host
+    _mkdir_batch_size = 64 << 10
+    # Keys of `connect_kwargs` which `ssh` can connect with as paramiko does, from the options of `_ssh_command`
+    _ssh_connect_kwargs = frozenset({'key_filename', 'timeout', 'compress', 'allow_agent', 'look_for_keys'})
+
+    def __init__(
+            self,
+            connection,
+            sfq_workers: int = 8,
+            lfq_workers: int = 2,
+            small_threshold: int = 1 << 20,
+            sftp_window_size: int = 1 << 27,
+            sftp_max_packet_size: int = 1 << 15,
+            verbose: bool = False,
+            compress: bool = False,
+            segment_size: int = 8 << 20,
+            segment_streams: int = 4,
+    ):
         """ Constructor.
 
+        Files to be uploaded are split by size into the small file queue, which is bound by latency
+        and uploaded by many workers, and the large file queue, which is bound by bandwidth and
+        uploaded by a few workers not to make the transfers compete for it.
+        A file of `segment_size` or larger is written in segments by `segment_streams` streams at the same time,
+        into a partial file from which an interrupted upload is resumed.
+
+        Args:
+            connection (Connection|Callable|SSHPool): A connection to a remote host, a callable returning it,
+                                                      or a pool of them
+            sfq_workers (int)                       : The number of small files to be uploaded in parallel
+            lfq_workers (int)                       : The number of large files to be uploaded in parallel
+            small_threshold (int)                   : The size in bytes below which a file is a small file
+            sftp_window_size (int)                  : The SSH window size in bytes of the SFTP channels to put files
+            sftp_max_packet_size (int)              : The maximum SSH packet size in bytes of the SFTP channels
+            verbose (bool)                          : Whether to run commands only to show information on host,
+                                                      of which output is logged at INFO
+            compress (bool)                         : Whether to compress the data sent over SSH
+            segment_size (int)                      : The size in bytes of a segment of a large file
+            segment_streams (int)                   : The number of segments of a file to be written in parallel
+        """
+
+        if not (isinstance(sfq_workers, int) and sfq_workers > 0):
+            raise ValueError('sfq_workers must be a positive integer.')
+        if not (isinstance(lfq_workers, int) and lfq_workers > 0):
+            raise ValueError('lfq_workers must be a positive integer.')
+        if not (isinstance(small_threshold, int) and small_threshold >= 0):
+            raise ValueError('small_threshold must be a non-negative integer.')
+        if not (isinstance(sftp_window_size, int) and sftp_window_size > 0):
+            raise ValueError('sftp_window_size must be a positive integer.')
+        if not (isinstance(sftp_max_packet_size, int) and sftp_max_packet_size > 0):
+            raise ValueError('sftp_max_packet_size must be a positive integer.')
+        if not (isinstance(segment_size, int) and segment_size > 0):
+            raise ValueError('segment_size must be a positive integer.')
+        if not (isinstance(segment_streams, int) and segment_streams > 0):
+            raise ValueError('segment_streams must be a positive integer.')
+
+        if callable(connection):
+            self._connection_factory = connection
+        else:
+            self._connection_factory = lambda: connection
+        self.compress = compress
+        self.sfq_workers = sfq_workers
+        self.lfq_workers = lfq_workers
+        self.small_threshold = small_threshold
+        self.sftp_window_size = sftp_window_size
+        self.sftp_max_packet_size = sftp_max_packet_size
+        self.verbose = verbose
+        self.segment_size = segment_size
+        self.segment_streams = segment_streams
+        self._stat_cache = {}
+        self._sftp_clients = {}
+
+    def close(self):
+        """Shuts down the upload workers and closes the idle connections.
+
+        The operator can be used again after this method, with new workers and connections.
+
+        """
+
+        for name in ('_sfq_pool', '_lfq_pool'):
+            executor = self.__dict__.pop(name, None)  # => Created again on their next use
+            if executor is not None:
+                executor.shutdown(wait=True)
+        for sftp in self._sftp_clients.values():
+            sftp.close()
+        self._sftp_clients.clear()
+        if '_pool' in self.__dict__:  # => Not to make a connection only to close it
+            self._pool.close()
+        # The connections are opened again on their next use, maybe after the host has changed
+        self.clear_cache()
+
+    @functools.cached_property
+    def connection(self):
+        """The connection or pool given to the constructor, or the connection returned by the callable."""
+
+        connection = self._connection_factory()
+        if self.compress and not connection.connect_kwargs.get('compress'):
+            from fabric import Connection
+
+            # Connections of a pool share the settings, so compress through another pool
+            settings = {name: getattr(connection, name) for name in SSHPool._settings}
+            settings['connect_kwargs'] = {**connection.connect_kwargs, 'compress': True}
+            connection = Connection(config=connection.config, **settings)
+        return connection
+
+    @functools.cached_property
+    def _pool(self):
+        if isinstance(self.connection, SSHPool):
+            return self.connection
+        # Share one pool between all of the operators connecting to the same host
+        return SSHPool.for_connection(self.connection, max_size=self.sfq_workers + self.lfq_workers)
+
+    @functools.cached_property
+    def _sfq_pool(self):
+        return ThreadPoolExecutor(max_workers=self.sfq_workers)
+
+    @functools.cached_property
+    def _lfq_pool(self):
+        return ThreadPoolExecutor(max_workers=self.lfq_workers)
+
+    def clear_cache(self):
+        """Forgets the results of the existence checks of remote paths.
+
+        Call this method if paths on host may have been changed by others than this object.
+
+        """
+
+        self._stat_cache.clear()
+
+    @classmethod
+    def _q(cls, path: str):
+        """Quotes a path for a shell on host, keeping a leading `~` or `~user` to be expanded."""
+
+        prefix, slash, rest = path.partition('/')
+        if not cls._tilde_prefix.fullmatch(prefix):
+            return shlex.quote(path)
+        return prefix + slash + (shlex.quote(rest) if rest else '')
+
+    def _remote_exists(self, path: str, **kwargs):
+        """Returns whether a path exists on host, caching the result."""
+
+        return self._remote_test('-e', path, **kwargs)
+
+    def _remote_isdir(self, path: str, **kwargs):
+        """Returns whether a path is a directory on host, caching the result."""
+
+        return self._remote_test('-d', path, **kwargs)
+
+    def _remote_test(self, flag: str, path: str, **kwargs):
+        key = (flag, path)
+        if key not in self._stat_cache:
+            command = f'test {flag} {self._q(path)}'
+            self._stat_cache[key] = self._run(command, warn=True, **kwargs).ok
+        return self._stat_cache[key]
+
+    def _remote_has_command(self, name: str, **kwargs):
+        """Returns whether a command is installed on host, caching the result."""
+
+        key = ('command', name)
+        if key not in self._stat_cache:
+            kwargs.setdefault('hide', True)
+            result = self._run(f'command -v {shlex.quote(name)}', warn=True, **kwargs)
+            self._stat_cache[key] = result.ok
+        return self._stat_cache[key]
+
+    def _cache_created(self, path: str, is_dir: bool):
+        self._stat_cache[('-e', path)] = True
+        self._stat_cache[('-d', path)] = is_dir
+
+    def _cache_changed(self, path: str):
+        # Forget the path and anything under it
+        for key in [k for k in self._stat_cache if k[1] == path or k[1].startswith(f'{path}/')]:
+            self._stat_cache.pop(key, None)
+
+    def _run(self, command: str, **kwargs):
+        """Runs a command through a connection checked out from the pool.
+
+        Args:
+            command (str): A shell command to be run on host
+            **kwargs     : See `invoke.Runner.run` for details on the available keyword arguments
+
+        Returns:
+            Result: A `fabric.runners.Result` of the command
+
+        """
+
+        with self._pool.get() as connection:
+            return connection.run(command, **kwargs)
+
+    def run_many(self, commands: list, **kwargs):
+        """Runs commands in order by one shell on host, in one round-trip.
+
+        The shell stops at the first command which fails, as `set -e` does.
+        The stdout of each command is logged after all of them finish, at INFO in verbose mode, else at DEBUG.
+
+        Args:
+            commands (list): Shell commands to be run on host
+            **kwargs       : See `invoke.Runner.run` for details on the available keyword arguments
+
+        Returns:
+            list: A `CommandResult` of each command which has run, of which only the last may have failed
+
+        """
+
+        return self._run_many(commands, **kwargs)[1]
+
+    def _run_many(self, commands: list, **kwargs):
+        # Returns the result of the shell as well, which tells why it stopped if no command has run
+
+        # Tell where the output of each command ends by a line no command prints
+        marker = f'---{uuid.uuid4().hex}---'
+        lines = []
+        for command in commands:
+            # The script itself is the stdin of the shell, so a command must not read the rest of it
+            lines.append(f'{{ {command}\n}} </dev/null')
+            lines.append(f"status=$?; printf '\\n{marker} %d\\n' $status; [ $status -eq 0 ] || exit $status")
+        # The outputs are logged below instead, unless told otherwise
+        kwargs.setdefault('hide', 'out')
+        result = self._run_script('\n'.join(lines), **kwargs)
+
+        results = []
+        stdout = result.stdout
+        for command in commands:
+            output, found, stdout = stdout.partition(f'\n{marker} ')
+            if not found:
+                break
+            status, _, stdout = stdout.partition('\n')
+            results.append(CommandResult(command, int(status), output))
+            self._log_output(output)
+        return result, results
+
+    def _log_output(self, output: str):
+        """Logs the stdout of a command hidden from the console, at INFO in verbose mode, else at DEBUG."""
+
+        if output:
+            log.log(logging.INFO if self.verbose else logging.DEBUG, '%s', output.rstrip('\n'))
+
+    def _run_steps(self, steps: list, **kwargs):
+        """Runs commands by `run_many` and raises an error for the first one which fails.
+
+        Each step is either a command which is allowed to fail, or a tuple of
+        (command, error message[, error type]).
+
+        Args:
+            steps (list): Commands to be run on host
+            **kwargs    : See `invoke.Runner.run` for details on the available keyword arguments
+
+        Returns:
+            list: A `CommandResult` of each step
+
+        Raises:
+            OSError: If a step failed, or the error type given for the step
+
+        """
+
+        steps = [(f'{{ {step}; }} || true', None) if isinstance(step, str) else step for step in steps]
+        result, results = self._run_many([step[0] for step in steps], **kwargs)
+        if len(results) == len(steps) and results[-1].exited == 0:
+            return results
+        if not results and result.failed:  # => The shell itself failed, such as if it is not found
+            raise OSError(f'Failed to run commands by command: {result.command}, error: {result.stderr.strip()}')
+
+        # The shell stopped at the last command which has run, or before the next one if it exited by itself
+        index = len(results) - 1 if results and results[-1].exited else len(results)
+        command, message, *error = steps[index] if steps[index][1] else (steps[index][0], 'Failed to run command')
+        raise (error[0] if error else OSError)(f'{message} by command: {command}')
+
+    def _run_script(self, script: str, remote_timeout: int = None, **kwargs):
+        """Runs a shell script given through stdin of a shell on host.
+
+        Unlike an argument of a command, the script does not appear in the command lines
+        of processes on host, so `pgrep -f` in the script does not find the shell running it.
+
         Args:
-            connection (Connection): A connection to a remote host
+            script (str)        : A shell script to be run on host
+            remote_timeout (int): Seconds after which the shell is killed by `timeout` on host
+            **kwargs            : See `invoke.Runner.run` for details on the available keyword arguments
+
+        Returns:
+            Result: A `fabric.runners.Result` of the script, of which exit status is 124 if timed out
+
+        """
+
+        # The scripts are of POSIX shell, not to depend on bash on host
+        command = 'sh -s' if remote_timeout is None else f'timeout {remote_timeout} sh -s'
+        # Exit explicitly, not to wait for the end of stdin
+        return self._run(command, in_stream=io.StringIO(f'{script}\nexit $?\n'), warn=True, **kwargs)
+
+    @staticmethod
+    def _running_script(process_name_pattern: str):
+        """Returns a command to count the processes of which command lines match a pattern.
+
+        `pgrep` finds them in one process instead of `ps`, `grep` and `grep -v grep`.
+        The command exits with 0 only if any of them are found.
+
         """
 
-        self.connection = connection
+        return f'pgrep -cf {shlex.quote(process_name_pattern)}'
+
+    @staticmethod
+    def _wait_script(condition: str):
+        """Returns a script which waits until a shell condition holds on host.
+
+        It probes with exponential backoff from 50ms to 1s, so a process which stops or starts quickly is noticed soon.
+
+        """
+
+        return (
+            'delay=0.05\n'
+            f'until {condition}; do\n'
+            '  sleep $delay\n'
+            '  case $delay in 0.05) delay=0.1;; 0.1) delay=0.2;; 0.2) delay=0.4;; 0.4) delay=0.8;; *) delay=1;; esac\n'
+            'done'
+        )
+
+    def _count_processes(self, running_script: str, **kwargs):
+        """Returns the number of processes counted by a command of `_running_script`.
+
+        Raises:
+            OSError: If failed to count the processes
+
+        """
+
+        # Only the count is printed, which is returned instead
+        kwargs.setdefault('hide', 'out')
+        result = self._run_script(running_script, **kwargs)
+        if result.exited not in (0, 1):  # => 1 means no process found
+            raise OSError(f'Failed to find processes by command: {running_script}')
+        return int(result.stdout.strip() or 0)
 
     def mkdir(self, remote_path: str, **kwargs):
         """Creates a directory on a remote host.
@@ -37,23 +383,32 @@ class RemoteOperator:
         if not (isinstance(remote_path, str) or remote_path):
             raise ValueError('remote_path must be string and not be None or empty.')
 
-        result = self.connection.run(f'ls -l {remote_path}', warn=True, **kwargs)
-        if result.failed:
-            result = self.connection.run(f'mkdir -pv {remote_path}', warn=True, **kwargs)
-            if result.failed:
-                raise OSError(f'Failed to create directory by command: {result.command}')
-            print(f'Directory is created by command: {result.command}')
+        if self._stat_cache.get(('-e', remote_path)):
+            return
+
+        # Check and create the directory in one round-trip
+        q_remote_path = self._q(remote_path)
+        command = f'test -e {q_remote_path} || mkdir -pv {q_remote_path}'
+        result, = self._run_steps([(command, 'Failed to create directory')], **kwargs)
+        self._cache_created(remote_path, is_dir=True)
+        if result.stdout:
+            log.info('Directory is created by command: %s', command)
 
-    def backup(self, path_from: str, path_to: str, **kwargs):
+    def backup(self, path_from: str, path_to: str, previous_backup: str = None, **kwargs):
         """Backs up an application.
 
         First create a backup directory with the specified 'path_to'.
         Then copies files from the specified 'path_from' to the backup directory.
 
+        Files are copied by `rsync` if it is installed on host, else by `cp`.
+        If 'previous_backup' is specified, files unchanged since the previous backup
+        are hard-linked to the files in it instead of being copied.
+
         Args:
-            path_from (str) : A path of flies to be backed up
-            path_to (str)   : A path of directory to back up the files to
-            **kwargs        : See `invoke.Runner.run` for details on the available keyword arguments
+            path_from (str)       : A path of flies to be backed up
+            path_to (str)         : A path of directory to back up the files to
+            previous_backup (str) : An absolute path of directory which the files were backed up to last time
+            **kwargs              : See `invoke.Runner.run` for details on the available keyword arguments
 
         Raises:
             ValueError: If an argument is invalid
@@ -65,26 +420,37 @@ class RemoteOperator:
             raise ValueError('path_from must be string and not be None or empty.')
         if not (isinstance(path_to, str) or path_to):
             raise ValueError('path_to must be string and not be None or empty.')
-        result = self.connection.run(f'ls -l {path_from}', warn=True, **kwargs)
-        if result.failed:
-            # Not to miss backing up files, raise an error if path does not exist
-            raise ValueError(f'path_from does exist on host by command: {result.command}')
-
-        # Create a backup directory
-        self.mkdir(path_to, **kwargs)
-
-        # Copy files to the backup directory
-        print('Backing up ...')
-        result = self.connection.run(f'cp -prv {path_from} {path_to}', warn=True)
-        if result.failed:
-            raise OSError(f'Failed to back up file(s) by command: {result.command}')
-        print(f'Backed up files by command: {result.command}')
+        # Without a trailing slash, rsync copies path_from itself into path_to as cp does
+        q_path_from = self._q(path_from.rstrip('/') or '/')
+        q_path_to = self._q(path_to)
+        verbose = 'v' if self.verbose else ''
+        link_dest = f'--link-dest={self._q(previous_backup)} ' if previous_backup else ''
+        copy_command = (
+            f'if command -v rsync >/dev/null; '
+            f'then rsync -a{verbose} {link_dest}{q_path_from} {q_path_to}/; '
+            f'else cp -pr{verbose} {q_path_from} {q_path_to}; fi'
+        )
+
+        # Check path_from, create a backup directory and copy files to it in one round-trip
+        log.info('Backing up ...')
+        try:
+            self._run_steps([
+                # Not to miss backing up files, raise an error if path does not exist
+                (f'test -e {q_path_from}', 'path_from does exist on host', ValueError),
+                (f'test -e {q_path_to} || mkdir -pv {q_path_to}', 'Failed to create directory'),
+                (copy_command, 'Failed to back up file(s)'),
+            ], **kwargs)
+        finally:
+            self._cache_changed(path_to)
+        self._cache_created(path_to, is_dir=True)
+        log.info('Backed up files by command: %s', copy_command)
 
     def upload(self, local_path: Path, remote_path: str, **kwargs):
         """Uploads a file or directory.
 
         If local_path is a directory, create the directory on host,
         else put a file on host.
+        The files in a directory are put in parallel by `sfq_workers` and `lfq_workers` workers.
 
         Args:
             local_path (Path) : A Path object of directory or file to be created on remote host
@@ -98,28 +464,392 @@ class RemoteOperator:
 
         """
 
-        # Validate arguments
+        self._validate_upload(local_path, remote_path, **kwargs)
+
+        if local_path.is_dir():
+            self._put_tree(local_path, remote_path, **kwargs)
+        else:
+            self._upload_files([(local_path.absolute(), f'{remote_path}/{local_path.name}')])
+
+    def upload_tree(self, local_path: Path, remote_path: str, rsync: bool = False, tar_stream: bool = False,
+                    **kwargs):
+        """Uploads a directory tree.
+
+        The directory of the given local_path is created under the remote_path on host.
+        All of the directories in the tree are created by one command,
+        then the files are put in parallel by `sfq_workers` and `lfq_workers` workers.
+        If rsync is True and `rsync` is installed on both local and remote hosts,
+        transfers the tree by `rsync` instead, unless `ssh` cannot connect as the connection does,
+        such as with a password, in which case the files are put as above.
+        Else if tar_stream is True and `tar` is installed on both hosts,
+        streams the tree as a tar archive over one SSH channel instead, which suits many small files.
+
+        Args:
+            local_path (Path) : A Path object of directory to be uploaded
+            remote_path (str) : An absolute path of directory on remote host
+            rsync (bool)      : Whether to transfer the tree by `rsync` if available
+            tar_stream (bool) : Whether to stream the tree by `tar` if available
+            **kwargs          : See `invoke.Runner.run` for details on the available keyword arguments
+
+        Raises:
+            TypeError         : If type of argument is invalid
+            ValueError        : If invalid arguments are specified
+            NotADirectoryError: If local_path is not a directory
+            OSError           : If any remote operations failed
+
+        """
+
+        self._validate_upload(local_path, remote_path, **kwargs)
+        if not local_path.is_dir():
+            raise NotADirectoryError(f'local_path is not a directory: {local_path}')
+
+        # `ssh` of rsync may be unable to connect as the pool does, in which case the files are put instead
+        rsh = self._ssh_command(self._pool, compress=self.compress) if rsync else None
+        if rsh and shutil.which('rsync') and self._remote_has_command('rsync', **kwargs):
+            self._rsync_tree(local_path, remote_path, rsh)
+        elif tar_stream and shutil.which('tar') and self._remote_has_command('tar', **kwargs):
+            self._tar_tree(local_path, remote_path)
+        else:
+            self._put_tree(local_path, remote_path, **kwargs)
+
+    def _validate_upload(self, local_path: Path, remote_path: str, **kwargs):
+        # Validate arguments once for a whole tree
         if not isinstance(local_path, Path):
             raise TypeError('Type of local_path must be pathlib.Path')
         if not (isinstance(remote_path, str) or remote_path):
             raise ValueError('remote_path must be string and not be None or empty.')
-        result = self.connection.run(f'test -d {remote_path}', warn=True, **kwargs)
+        if not self._remote_isdir(remote_path, **kwargs):
+            raise OSError(f'Remote path does not exists or is not a directory, path: {remote_path}.')
+
+    def _put_tree(self, local_path: Path, remote_path: str, **kwargs):
+        dirs, files = self._walk(local_path, remote_path)
+        # Create all of the directories first, so the files can be put in any order
+        self._batch_mkdir(dirs, **kwargs)
+        self._upload_files(files)
+
+    def _batch_mkdir(self, dirs: list, **kwargs):
+        """Creates directories on host by one script.
+
+        The paths are split into `mkdir -p` commands of bounded length given through stdin,
+        so a large tree does not exceed the limit on the arguments of a command.
+
+        Raises:
+            OSError: If failed to create any of the directories
+
+        """
+
+        lines = ['set -e']
+        args, length = [], 0
+        for q_dir in map(self._q, dirs):
+            if args and length + len(q_dir) > self._mkdir_batch_size:
+                lines.append('mkdir -p ' + ' '.join(args))
+                args, length = [], 0
+            args.append(q_dir)
+            length += len(q_dir) + 1
+        lines.append('mkdir -p ' + ' '.join(args))
+        result = self._run_script('\n'.join(lines), **kwargs)
         if result.failed:
-            raise OSError(f'Remote path does not exists or is not a directory by command: {result.command}.')
+            raise OSError(f'Failed to create directories, error: {result.stderr.strip()}')
+        for d in dirs:
+            self._cache_created(d, is_dir=True)
+        log.info('%s directories are created', len(dirs))
+
+    def _rsync_tree(self, local_path: Path, remote_path: str, rsh: list):
+        destination = f'{self._ssh_destination(self._pool)}:{remote_path}/'
+
+        # Without a trailing slash, rsync creates the directory of local_path under remote_path
+        # Protect the remote path from being split into words by the shell on host
+        # Not `-z`, since `ssh` of rsh compresses the data as the connection does
+        command = [
+            'rsync', '-a', '--protect-args', '--rsh', shlex.join(rsh),
+            str(local_path.absolute()), destination,
+        ]
+        result = subprocess.run(command)
+        if result.returncode != 0:
+            raise OSError(f'Failed to upload directory by command: {shlex.join(command)}')
+        self._cache_changed(f'{remote_path}/{local_path.name}')
+        log.info('Uploaded %s to %s by rsync', local_path, destination)
+
+    @classmethod
+    def _ssh_command(cls, settings, compress: bool = False):
+        """Returns an `ssh` command which connects as a connection or pool with the given settings does.
+
+        The command ends with its options, so the destination of `_ssh_destination` is to be appended to it.
+        A gateway of `Connection` is reached through a `ProxyCommand` of its own `ssh` command,
+        and a gateway of string is used as `ProxyCommand` as it is.
 
-        # Create a directory on remote host if the given local path is a directory
-        if local_path.is_dir():
-            self.mkdir(f'{remote_path}/{local_path.name}', **kwargs)
-            for p in local_path.iterdir():
-                # The directory of the given path_local is created under the remote_path on host,
-                # so pass the remote path including the path of the created directory to the method
-                self.upload(p, f'{remote_path}/{local_path.name}', **kwargs)
+        Args:
+            settings (Connection|SSHPool): A connection or pool of which settings are to be reproduced
+            compress (bool)              : Whether to compress the data sent over SSH
+
+        Returns:
+            list: The arguments of the command, or None if `ssh` cannot authenticate as the settings do,
+                  such as by a password or a key object
+
+        """
+
+        connect_kwargs = settings.connect_kwargs or {}
+        if set(connect_kwargs) - cls._ssh_connect_kwargs:
+            return None
+        command = ['ssh']
+        if settings.port:
+            command += ['-p', str(settings.port)]
+        key_filename = connect_kwargs.get('key_filename')
+        for key in [key_filename] if isinstance(key_filename, str) else key_filename or []:
+            command += ['-i', key]
+        connect_timeout = settings.connect_timeout or connect_kwargs.get('timeout')
+        if connect_timeout:
+            command += ['-o', f'ConnectTimeout={connect_timeout}']
+        if settings.forward_agent:
+            command += ['-A']
+        if compress or connect_kwargs.get('compress'):
+            command += ['-C']
+
+        gateway = settings.gateway
+        if isinstance(gateway, str):
+            command += ['-o', f'ProxyCommand={gateway}']
+        elif gateway is not None:
+            proxy = cls._ssh_command(gateway)
+            if proxy is None:
+                return None
+            proxy += ['-W', '%h:%p', cls._ssh_destination(gateway)]
+            command += ['-o', f'ProxyCommand={shlex.join(proxy)}']
+        return command
+
+    @staticmethod
+    def _ssh_destination(settings):
+        """Returns the destination of `ssh` to connect to the host of a connection or pool."""
+
+        return f'{settings.user}@{settings.host}' if settings.user else settings.host
+
+    def _tar_tree(self, local_path: Path, remote_path: str):
+        command = f'tar xf - -C {self._q(remote_path)}'
+        with self._pool.get() as connection:
+            # Write to the channel directly, since `Connection.run` decodes the stdin as text
+            connection.open()
+            channel = connection.transport.open_session()
+            output = bytearray()
+
+            def drain():
+                # The window of the channel opens only as its output is read, so read it while sending,
+                # or `tar` on host stops reading its stdin once its warnings fill the window
+                for data in iter(lambda: channel.recv(1 << 16), b''):
+                    output.extend(data)
+
+            reader = threading.Thread(target=drain, daemon=True)
+            try:
+                channel.set_combine_stderr(True)
+                channel.exec_command(command)
+                reader.start()
+                with subprocess.Popen(
+                        ['tar', 'cf', '-', '-C', str(local_path.absolute().parent), local_path.name],
+                        stdout=subprocess.PIPE,
+                ) as tar:
+                    try:
+                        for chunk in iter(lambda: tar.stdout.read(1 << 16), b''):
+                            channel.sendall(chunk)
+                    except OSError:  # => `tar` on host exited early, of which the error is in its output
+                        pass
+                channel.shutdown_write()
+                status = channel.recv_exit_status()
+                reader.join()
+            finally:
+                channel.close()
+        self._cache_changed(f'{remote_path}/{local_path.name}')
+        error = output.decode(errors='replace').strip()
+        if tar.returncode != 0 or status != 0:
+            raise OSError(f'Failed to upload directory by command: {command}, error: {error}')
+        if error:
+            log.debug('%s', error)
+        log.info('Uploaded %s to %s by tar', local_path, remote_path)
+
+    @staticmethod
+    def _walk(local_path: Path, remote_path: str):
+        """Walks a local tree once and collects what is to be created on remote host.
+
+        Args:
+            local_path (Path) : A Path object of directory to be uploaded
+            remote_path (str) : An absolute path of directory on remote host
+
+        Returns:
+            tuple: A list of remote directories to be created, in parent-first order,
+                   and a list of (local file, remote file) pairs to be put
 
-        # Upload the file
+        """
+
+        # Walk breadth-first with a queue, not to recurse a Python frame per directory
+        dirs, files = [], []
+        queue = collections.deque([(local_path.absolute(), remote_path)])
+        while queue:
+            lp, rp = queue.popleft()
+            # The directory of lp is created under rp on host
+            remote = f'{rp}/{lp.name}'
+            if lp.is_dir():
+                dirs.append(remote)
+                queue.extend((p, remote) for p in lp.iterdir())
+            else:
+                files.append((lp, remote))
+        return dirs, files
+
+    def _upload_files(self, pairs: list):
+        """Puts files on remote host in parallel.
+
+        The files are split into the small and large file queues by `small_threshold`,
+        and each queue into one chunk per worker of it. Each worker puts its chunk through
+        a connection checked out from the pool, because a connection must not be shared
+        between threads. So a connection is checked out once per worker, not per file.
+
+        Args:
+            pairs (list): A list of (local file, remote file) pairs
+
+        Raises:
+            OSError: If failed to put any of the files
+
+        """
+
+        sfq, lfq = [], []
+        for pair in pairs:
+            (sfq if pair[0].stat().st_size < self.small_threshold else lfq).append(pair)
+
+        # Start both of the queues before waiting for either
+        results = [
+            self._map_chunks(self._sfq_pool, self.sfq_workers, sfq),
+            self._map_chunks(self._lfq_pool, self.lfq_workers, lfq),
+        ]
+        for chunk_results in results:
+            for chunk_result in chunk_results:
+                for local, remote in chunk_result:
+                    self._cache_created(remote, is_dir=False)
+                    log.debug('Uploaded %s to %s', local, remote)
+        log.info('Uploaded %s file(s)', len(pairs))
+
+    def _map_chunks(self, executor: ThreadPoolExecutor, workers: int, pairs: list):
+        chunks = [pairs[i::workers] for i in range(min(workers, len(pairs)))]
+        return executor.map(self._upload_chunk, chunks)
+
+    def _upload_chunk(self, pairs: list):
+        with self._pool.get() as connection:
+            sftp = self._sftp(connection)
+            for local, remote in pairs:
+                if local.stat().st_size >= self.segment_size:
+                    self._put_resumable(connection, sftp, local, remote)
+                else:
+                    with open(local, 'rb') as f:
+                        # Not to stat the remote file for each put, skip confirming its size
+                        sftp.putfo(f, remote, confirm=False)
+                # Preserve the mode as `Connection.put` does
+                sftp.chmod(remote, os.stat(local).st_mode & 0o7777)
+        return pairs
+
+    def _put_resumable(self, connection: 'Connection', sftp: 'SFTPClient', local: Path, remote: str):
+        """Puts a large file in parallel segments, resuming a previous upload interrupted midway.
+
+        The segments are written into `<remote>.part`, which is renamed to the remote path
+        only after all of them are written, so an interrupted upload never leaves a broken file.
+        They are written round by round of `segment_streams` segments, so all of the rounds
+        before the one in which the previous upload stopped are complete, and it is resumed from that round.
+        The size and mtime of the local file, `segment_size` and `segment_streams` are recorded
+        in `<remote>.part.source`, and the upload starts over if the previous one differs in any of them.
+
+        Args:
+            connection (Connection): A connection checked out from the pool, which the streams are opened on
+            sftp (SFTPClient)      : An SFTP client of the connection
+            local (Path)           : A Path object of the file to be put
+            remote (str)           : A path of the file on remote host
+
+        """
+
+        stat = local.stat()
+        size = stat.st_size
+        part = f'{remote}.part'
+        source_path = f'{part}.source'
+        source = f'{size} {stat.st_mtime_ns} {self.segment_size} {self.segment_streams}'
+        round_size = self.segment_size * self.segment_streams
+        try:
+            with sftp.open(source_path, 'r') as f:
+                same_source = f.read().decode() == source
+            part_size = sftp.stat(part).st_size if same_source else 0
+        except FileNotFoundError:
+            part_size = 0
+
+        offset = self._resume_offset(part_size, size, round_size)
+        if offset:
+            log.info('Resuming to upload %s from %s bytes', local, offset)
         else:
-            result = self.connection.put(local_path.absolute(), f'{remote_path}/{local_path.name}')
-            print(f'Uploaded {result.local} to {result.remote}')
-            return
+            # Truncate the partial file before recording its source, so it is never taken for the new one
+            sftp.open(part, 'wb').close()
+            with sftp.open(source_path, 'w') as f:
+                f.write(source)
+
+        from paramiko import SFTPClient
+
+        # An SFTP client must not be shared between threads, so each stream has its own session
+        streams = [
+            SFTPClient.from_transport(
+                connection.transport,
+                window_size=self.sftp_window_size,
+                max_packet_size=self.sftp_max_packet_size,
+            )
+            for _ in range(self.segment_streams)
+        ]
+        fd = os.open(local, os.O_RDONLY)
+        try:
+            put = functools.partial(self._put_segment, fd=fd, part=part, size=size)
+            with ThreadPoolExecutor(max_workers=self.segment_streams) as executor:
+                for start in range(offset, size, round_size):
+                    segments = range(start, min(start + round_size, size), self.segment_size)
+                    list(executor.map(put, streams, segments))
+        finally:
+            os.close(fd)
+            for stream in streams:
+                stream.close()
+        sftp.posix_rename(part, remote)
+        sftp.remove(source_path)
+
+    @staticmethod
+    def _resume_offset(part_size: int, size: int, round_size: int):
+        """Returns the offset to resume from, which is the start of the round the previous upload stopped in.
+
+        Args:
+            part_size (int) : The size of the partial file on host, which is 0 if it does not exist
+            size (int)      : The size of the local file
+            round_size (int): The bytes written in one round, `segment_size` times `segment_streams`
+
+        Returns:
+            int: The offset of the first byte to be written
+
+        """
+
+        if not part_size or part_size > size:  # => The partial file is not of this file
+            return 0
+        return (part_size - 1) // round_size * round_size
+
+    def _put_segment(self, sftp: 'SFTPClient', offset: int, fd: int, part: str, size: int):
+        with sftp.open(part, 'r+b') as f:
+            f.set_pipelined(True)
+            f.seek(offset)
+            f.write(os.pread(fd, min(self.segment_size, size - offset), offset))
+
+    def _sftp(self, connection: 'Connection'):
+        """Returns the SFTP client of a connection, opening it on the first call.
+
+        Unlike `Connection.sftp`, the client is opened with the window and packet sizes
+        of this object, so many write requests of a file can be in flight on a long-RTT link.
+
+        """
+
+        sftp = self._sftp_clients.get(id(connection))
+        if sftp is None or sftp.get_channel().closed:
+            from paramiko import SFTPClient
+
+            connection.open()
+            sftp = SFTPClient.from_transport(
+                connection.transport,
+                window_size=self.sftp_window_size,
+                max_packet_size=self.sftp_max_packet_size,
+            )
+            self._sftp_clients[id(connection)] = sftp
+        return sftp
 
     @contextlib.contextmanager
     def disable_crontab(self, workspace: str, save_filename: str, **kwargs):
@@ -159,30 +889,23 @@ class RemoteOperator:
             raise ValueError('workspace must be string and not be None or empty.')
         if not (isinstance(save_filename, str) or save_filename):
             raise ValueError('save_filename must be string and not be None or empty.')
-        result = self.connection.run(f'test -d {workspace}', warn=True, **kwargs)
-        if result.failed:
-            raise OSError(f'workspace does not exist or is not a directory by command: {result.command}.')
-
-        # Save original crontab file
-        result = self.connection.run(f'crontab -l > {workspace}/{save_filename}', warn=True, **kwargs)
-        if result.failed:
-            raise OSError(f'Failed to save the crontab file by command: {result.command}')
-
-        print(f'Saved original crontab file by command: {result.command}')
-        self.connection.run(f'cat {workspace}/{save_filename}', warn=True)
-
-        # Create an empty file
-        empty_filename = 'crontab.empty'
-        self.connection.run(f'rm {workspace}/{empty_filename}', warn=True)  # Remove a old file
-        result = self.connection.run(f'touch {workspace}/{empty_filename}', warn=True, **kwargs)
-        if result.failed:
-            raise OSError(f'Failed to create a file by command: {result.command}')
-
-        # Set crontab to empty file
-        result = self.connection.run(f'crontab {workspace}/{empty_filename}', warn=True, **kwargs)
-        if result.failed:
-            raise OSError(f'Failed to disable crontab by command: {result.command}')
-        print(f'Disabled crontab by command: {result.command}')
+        save_path = f'{workspace}/{save_filename}'
+        empty_path = f'{workspace}/crontab.empty'
+
+        q_save_path = self._q(save_path)
+        q_empty_path = self._q(empty_path)
+
+        # Save original crontab file, create an empty file and set crontab to it in one round-trip
+        self._run_steps([
+            (f'test -d {self._q(workspace)}', 'workspace does not exist or is not a directory'),
+            (f'crontab -l > {q_save_path}', 'Failed to save the crontab file'),
+            *([f'cat {q_save_path}'] if self.verbose else []),
+            f'rm -f {q_empty_path}',  # Remove a old file
+            (f'touch {q_empty_path}', 'Failed to create a file'),
+            (f'crontab {q_empty_path}', 'Failed to disable crontab'),
+        ], **kwargs)
+        log.info('Saved original crontab file to: %s', save_path)
+        log.info('Disabled crontab with file: %s', empty_path)
 
         try:
             yield
@@ -209,26 +932,25 @@ class RemoteOperator:
         if not (isinstance(file_path, str) or file_path):
             raise ValueError('file_path must be string and not be None or empty.')
 
-        result = self.connection.run(f'ls -l {file_path}', warn=True, **kwargs)
-        if result.failed:
-            raise FileNotFoundError(f'Specified file is not found by command: {result.command}')
-
-        print('Before enabling crontab')
-        self.connection.run(f'crontab -l', warn=True)
-
-        # Set crontab to the specified file
-        result = self.connection.run(f'crontab {file_path}', warn=True, **kwargs)
-        if result.failed:
-            raise OSError(f'Failed to enable crontab by command: {result.command}')
-        print(f'Enabled crontab by command: {result.command}')
-
-        print('After enabling crontab')
-        self.connection.run(f'crontab -l', warn=True)
+        # Set crontab to the specified file in one round-trip
+        q_file_path = self._q(file_path)
+        probe = 'ls -l' if self.verbose else 'test -e'
+        # Show crontab before and after enabling it only in verbose mode
+        show_before = ["echo 'Before enabling crontab'", 'crontab -l'] if self.verbose else []
+        show_after = ["echo 'After enabling crontab'", 'crontab -l'] if self.verbose else []
+        self._run_steps([
+            (f'{probe} {q_file_path}', 'Specified file is not found', FileNotFoundError),
+            *show_before,
+            (f'crontab {q_file_path}', 'Failed to enable crontab'),
+            *show_after,
+        ], **kwargs)
+        log.info('Enabled crontab with file: %s', file_path)
 
     def stop_process_with_kill_file(
             self,
             to_be_created_kill_file_path: str,
             process_name_pattern: str,
+            remote_timeout: int = 60,
             **kwargs
     ):
         """Stops an application.
@@ -239,46 +961,48 @@ class RemoteOperator:
         1) If the application already stopped, does nothing and exits this method.
         2) Creates a kill file under the specified path.
         3) Confirms that the application has stopped.
-           It will be timed-out after 60 seconds.
+           It will be timed-out after `remote_timeout` seconds.
 
         Args:
             to_be_created_kill_file_path (str): A path of a kill file which will be created
             process_name_pattern (str)        : A pattern of an app process name to grep system processes with
+            remote_timeout (int)              : Seconds to wait for the application to stop
             **kwargs                          : See `invoke.Runner.run` for details on the available keyword arguments
 
         """
 
+        running_script = self._running_script(process_name_pattern)
+        # The outputs are logged instead, unless told otherwise
+        kwargs.setdefault('hide', 'out')
+
         # Check if application has been running
-        result = self.connection.run(f'ps -ef | grep {process_name_pattern} | grep -v grep', warn=True, **kwargs)
-        if result.failed:
-            print(f'Application has not been running by command: {result.command}')
-            print('Skip stopping process')
+        if not self._count_processes(running_script, **kwargs):
+            log.info('Application has not been running by command: %s', running_script)
+            log.info('Skip stopping process')
             return
 
         # Stop the process by creating a kill file
-        result = self.connection.run(f'touch {to_be_created_kill_file_path}', warn=True, **kwargs)
+        result = self._run(f'touch {self._q(to_be_created_kill_file_path)}', warn=True, **kwargs)
         if result.failed:
             raise OSError(f'Failed to create a kill file by command: {result.command}')
 
-        # Confirm that application stopped
-        max_limit_time = time.time() + 60
-        while True:
-            current_time = time.time()
-            if current_time >= max_limit_time:
-                raise OSError('Process could not be stopped within 60 seconds, Please check the server spec.')
-
-            result = self.connection.run(f'ps -ef | grep {process_name_pattern} | grep -v grep', warn=True, **kwargs)
-            if result.failed:  # => No process found
-                print(f'Confirmed that the application has stopped by command: {result.command}')
-                break
-            else:
-                time.sleep(1)
+        # Confirm that application stopped, waiting on host not to probe it for each second over SSH
+        script = self._wait_script(condition=f'! {running_script} >/dev/null')
+        result = self._run_script(script, remote_timeout=remote_timeout, **kwargs)
+        if result.exited == 124:  # => Timed out
+            raise OSError(
+                f'Process could not be stopped within {remote_timeout} seconds, Please check the server spec.'
+            )
+        if result.failed:
+            raise OSError(f'Failed to confirm that the application has stopped by command: {script}')
+        log.info('Confirmed that the application has stopped by command: %s', running_script)
 
     def start_process_with_kill_file(
             self,
             to_be_removed_kill_file_path: str,
             process_name_pattern: str,
             exec_file_path: str,
+            remote_timeout: int = 60,
             **kwargs
     ):
         """Starts an application.
@@ -290,50 +1014,56 @@ class RemoteOperator:
         2) Removes a kill file
         3) Runs an execution file of an application.
         4) Confirms that the application has started.
-           It will be timed-out after 60 seconds.
+           It will be timed-out after `remote_timeout` seconds.
 
         Args:
             to_be_removed_kill_file_path (str): A path of a kill file which will be removed
             process_name_pattern (str)        : A pattern of an app process name to grep system processes with
             exec_file_path (str)              : A path of an execution file of application
+            remote_timeout (int)              : Seconds to wait for the application to start
             **kwargs                          : See `invoke.Runner.run` for details on the available keyword arguments
 
         """
 
+        running_script = self._running_script(process_name_pattern)
+        # The outputs are logged instead, unless told otherwise
+        kwargs.setdefault('hide', 'out')
+
         # Check if application has been running
-        result = self.connection.run(f'ps -ef | grep {process_name_pattern} | grep -v grep', warn=True, **kwargs)
-        if result.ok:
-            print(f'Application has already been running by command: {result.command}')
-            print('Skip starting process')
+        if self._count_processes(running_script, **kwargs):
+            log.info('Application has already been running by command: %s', running_script)
+            log.info('Skip starting process')
             return
 
         # Remove the kill file
-        result = self.connection.run(f'ls -l {to_be_removed_kill_file_path}', warn=True)
+        q_kill_file_path = self._q(to_be_removed_kill_file_path)
+        probe = 'ls -l' if self.verbose else 'test -e'
+        result = self._run(f'{probe} {q_kill_file_path}', warn=True, **kwargs)
+        self._log_output(result.stdout)
         if result.ok:
-            result = self.connection.run(f'rm -v {to_be_removed_kill_file_path}', warn=True)
+            result = self._run(f'rm -v {q_kill_file_path}', warn=True, **kwargs)
+            self._log_output(result.stdout)
             if result.failed:
                 raise OSError(f'Failed to remove the kill file by command: {to_be_removed_kill_file_path}')
         else:
-            print(f'Kill file did not exist, path: {to_be_removed_kill_file_path}')
-            print('Skip removing the kill file')
+            log.info('Kill file did not exist, path: %s', to_be_removed_kill_file_path)
+            log.info('Skip removing the kill file')
 
         # Start the application
-        print('Staring the application ...')
-        result = self.connection.run(f'nohup sh {exec_file_path} &', warn=True, pty=True, **kwargs)
+        log.info('Staring the application ...')
+        result = self._run(f'nohup sh {self._q(exec_file_path)} &', warn=True, pty=True, **kwargs)
+        self._log_output(result.stdout)
         if result.failed:
             raise OSError(f'Failed to start the application by command: {result.command}')
 
-        # Confirm that the application is running
-        max_limit_time = time.time() + 60
-        while True:
-            current_time = time.time()
-            if current_time >= max_limit_time:
-                raise OSError('Process could not be started within 60 seconds, Please check the server spec.')
-
-            result = self.connection.run(f'ps -ef | grep {process_name_pattern} | grep -v grep', warn=True, **kwargs)
-            if result.ok:  # => Process found
-                print(f'Confirmed that the application has started by command: {result.command}')
-                break
-            else:
-                print('Waiting for the application to start ...')
-                time.sleep(1)
+        # Confirm that the application is running, waiting on host not to probe it for each second over SSH
+        log.debug('Waiting for the application to start ...')
+        script = self._wait_script(condition=f'{running_script} >/dev/null')
+        result = self._run_script(script, remote_timeout=remote_timeout, **kwargs)
+        if result.exited == 124:  # => Timed out
+            raise OSError(
+                f'Process could not be started within {remote_timeout} seconds, Please check the server spec.'
+            )
+        if result.failed:
+            raise OSError(f'Failed to confirm that the application has started by command: {script}')
+        log.info('Confirmed that the application has started by command: %s', running_script)
@@ -0,0 +1,201 @@
+import collections
+import contextlib
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fabric import Connection
+
+
+class SSHPool:
+    """ This class provides a pool of connections to a remote host.
+
+    Connections are checked out in LIFO order, so the most recently used one,
+    which is the most likely to be still connected, is reused first.
+    A connection is opened lazily by fabric on its first use and is kept open
+    while it is in the pool, so repeated commands do not pay connect and auth cost again.
+
+    Use `SSHPool.for_connection` to share one pool between all callers
+    connecting to the same host with the same settings.
+
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+    # Attributes of `fabric.connection.Connection` which new connections of a pool are made with
+    _settings = (
+        'host',
+        'user',
+        'port',
+        'gateway',
+        'forward_agent',
+        'connect_timeout',
+        'connect_kwargs',
+        'inline_ssh_env',
+    )
+
+    def __init__(
+            self,
+            host: str,
+            user: str = None,
+            port: int = None,
+            config=None,
+            gateway=None,
+            forward_agent: bool = None,
+            connect_timeout: int = None,
+            connect_kwargs: dict = None,
+            inline_ssh_env: bool = None,
+            max_size: int = 8,
+    ):
+        """ Constructor.
+
+        The arguments other than max_size are given to `fabric.connection.Connection` of new connections.
+
+        Args:
+            host (str)              : A host name to connect to
+            user (str)              : A user name to connect as
+            port (int)              : A port number to connect to
+            config (Config)         : A `fabric.config.Config` object for new connections
+            gateway (Connection|str): A gateway to connect through, such as a bastion host
+            forward_agent (bool)    : Whether to forward the local SSH agent
+            connect_timeout (int)   : Seconds to wait for connecting
+            connect_kwargs (dict)   : Keyword arguments passed to `paramiko.client.SSHClient.connect`
+            inline_ssh_env (bool)   : Whether to send environment variables inline with commands
+            max_size (int)          : The maximum number of connections in this pool
+
+        Raises:
+            ValueError: If an argument is invalid
+
+        """
+
+        if not (isinstance(max_size, int) and max_size > 0):
+            raise ValueError('max_size must be a positive integer.')
+
+        self.host = host
+        self.user = user
+        self.port = port
+        self.config = config
+        self.gateway = gateway
+        self.forward_agent = forward_agent
+        self.connect_timeout = connect_timeout
+        self.connect_kwargs = connect_kwargs or {}
+        self.inline_ssh_env = inline_ssh_env
+        self.max_size = max_size
+        self._connections = []
+        self._idle = collections.deque()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def for_connection(cls, connection: 'Connection', max_size: int = 8):
+        """Returns the pool shared by connections with the same settings as the given one.
+
+        The pool is created on the first call and the given connection is added to it.
+        The pool grows to the largest max_size requested by any of the callers sharing it.
+
+        Args:
+            connection (Connection): A connection to a remote host
+            max_size (int)         : The maximum number of connections the caller needs
+
+        Returns:
+            SSHPool: A pool keyed on the settings of the connection to connect with
+
+        """
+
+        settings = {name: getattr(connection, name) for name in cls._settings}
+        key = tuple(
+            repr(sorted(value.items())) if isinstance(value, dict) else repr(value)
+            for value in settings.values()
+        )
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls(config=connection.config, max_size=max_size, **settings)
+                cls._pools[key] = pool
+        pool.grow(max_size)
+        pool.add(connection)
+        return pool
+
+    def add(self, connection: 'Connection'):
+        """Adds an existing connection to this pool.
+
+        Does nothing if the connection is already in this pool or this pool is full.
+
+        Args:
+            connection (Connection): A connection to a remote host
+
+        """
+
+        with self._condition:
+            if connection in self._connections or len(self._connections) >= self.max_size:
+                return
+            self._connections.append(connection)
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def grow(self, max_size: int):
+        """Raises the maximum number of connections in this pool.
+
+        Does nothing if this pool is already as large as the given size.
+
+        Args:
+            max_size (int): The maximum number of connections in this pool
+
+        Raises:
+            ValueError: If an argument is invalid
+
+        """
+
+        if not (isinstance(max_size, int) and max_size > 0):
+            raise ValueError('max_size must be a positive integer.')
+
+        with self._condition:
+            if max_size > self.max_size:
+                self.max_size = max_size
+                # Callers waiting for a connection can open a new one now
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def get(self):
+        """Checks out a connection from this pool.
+
+        This method uses `contextlib.contextmanager` and is expected to use with the `with` statement.
+        The connection is returned to this pool when the `with` statement finishes.
+        If all of the connections are in use and this pool is full, waits for one to be returned.
+
+        Usage:
+            with pool.get() as connection:
+                connection.run('hostname')
+
+        """
+
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            with self._condition:
+                self._idle.append(connection)
+                self._condition.notify()
+
+    def close(self):
+        """Closes all of the idle connections in this pool.
+
+        The connections stay in this pool and are opened again on their next use.
+
+        """
+
+        with self._condition:
+            for connection in self._idle:
+                connection.close()
+
+    def _checkout(self):
+        with self._condition:
+            while not self._idle and len(self._connections) >= self.max_size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+
+            from fabric import Connection
+
+            connection = Connection(config=self.config, **{name: getattr(self, name) for name in self._settings})
+            self._connections.append(connection)
+            return connection
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+
+import asyncssh
+
+from remote.async_remote_operator import AsyncRemoteOperator
+
+
+class _SFTPClient:
+    """Stands for `asyncssh.SFTPClient`, serving the local file system and counting the puts in flight."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def makedirs(self, path, exist_ok=False):
+        try:
+            os.makedirs(path, exist_ok=exist_ok)
+        except OSError as e:
+            raise asyncssh.SFTPFailure(str(e)) from e
+
+    async def put(self, local_path, remote_path, preserve=False):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Let the other uploads run, as a put over the network does
+            await asyncio.sleep(0.01)
+            (shutil.copy2 if preserve else shutil.copyfile)(local_path, remote_path)
+        finally:
+            self.in_flight -= 1
+
+
+class _Connection:
+    """Stands for `asyncssh.SSHClientConnection`, running the commands by the local shell."""
+
+    def __init__(self):
+        self.commands = []
+        self.sftp = _SFTPClient()
+
+    async def run(self, command, check=False, input=None):
+        self.commands.append(command)
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(input.encode() if input is not None else None)
+        return asyncssh.SSHCompletedProcess(
+            command=command, exit_status=process.returncode, stdout=stdout.decode(), stderr=stderr.decode(),
+        )
+
+    def start_sftp_client(self):
+        return self.sftp
+
+
+class TestUpload(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # A wide tree of many directories, each of a few files
+        self.local = Path(tmp.name, 'app')
+        for i in range(50):
+            Path(self.local, f'dir{i}', 'sub').mkdir(parents=True)
+            for j in range(3):
+                Path(self.local, f'dir{i}', f'file{j}').write_text(f'{i} {j}')
+            Path(self.local, f'dir{i}', 'sub', 'file').write_text(str(i))
+        self.remote = Path(tmp.name, 'remote')
+        self.remote.mkdir()
+        self.connection = _Connection()
+        self.operator = AsyncRemoteOperator(self.connection, concurrency=4)
+
+    def test_upload_wide_tree(self):
+        asyncio.run(self.operator.upload(self.local, str(self.remote)))
+        for path in self.local.rglob('*'):
+            uploaded = Path(self.remote, 'app', path.relative_to(self.local))
+            if path.is_dir():
+                self.assertTrue(uploaded.is_dir(), uploaded)
+            else:
+                self.assertEqual(uploaded.read_text(), path.read_text())
+        # The directories are created through the SFTP session, not by a command per directory
+        self.assertEqual(self.connection.commands, [f'test -d {self.remote}'])
+        self.assertEqual(self.connection.sftp.max_in_flight, 4)
+
+    def test_upload_in_another_loop(self):
+        # The operator is used by another loop than the one it was first used in
+        asyncio.run(self.operator.upload(self.local, str(self.remote)))
+        asyncio.run(self.operator.upload(self.local, str(self.remote)))
+        self.assertEqual(self.connection.sftp.max_in_flight, 4)
+
+    def test_raise_if_directory_cannot_be_created(self):
+        Path(self.remote, 'app').write_text('not a directory')
+        with self.assertRaises(OSError) as cm:
+            asyncio.run(self.operator.upload(self.local, str(self.remote)))
+        self.assertIn(f'{self.remote}/app', str(cm.exception))
+
+    def test_raise_if_remote_path_is_not_directory(self):
+        with self.assertRaises(OSError):
+            asyncio.run(self.operator.upload(self.local, f'{self.remote}/none'))
+
+
+class TestBackup(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.app = Path(tmp.name, 'app')
+        self.app.mkdir()
+        Path(self.app, 'app.jar').write_text('app')
+        self.operator = AsyncRemoteOperator(_Connection())
+
+    def test_backup(self):
+        asyncio.run(self.operator.backup(str(self.app), f'{self.tmp}/backup'))
+        self.assertEqual(Path(self.tmp, 'backup', 'app', 'app.jar').read_text(), 'app')
+
+    def test_raise_if_path_from_does_not_exist(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(self.operator.backup(f'{self.app}/none', f'{self.tmp}/backup'))
+
+    def test_raise_if_directory_cannot_be_created(self):
+        Path(self.tmp, 'file').write_text('not a directory')
+        with self.assertRaises(OSError) as cm:
+            asyncio.run(self.operator.backup(str(self.app), f'{self.tmp}/file/backup'))
+        self.assertIn('Failed to create directory', str(cm.exception))
+
+    def test_raise_if_files_cannot_be_copied(self):
+        Path(self.tmp, 'file').write_text('not a directory')
+        with self.assertRaises(OSError) as cm:
+            # The path exists, so mkdir is skipped, and cp fails to copy a directory over a file
+            asyncio.run(self.operator.backup(str(self.app), f'{self.tmp}/file'))
+        self.assertIn('Failed to back up', str(cm.exception))
+
+    def test_mkdir_raise_for_invalid_path(self):
+        Path(self.tmp, 'file').write_text('not a directory')
+        with self.assertRaises(OSError):
+            asyncio.run(self.operator.mkdir(f'{self.tmp}/file/dir'))
+
+
+class TestWaitForProcesses(unittest.TestCase):
+
+    def setUp(self):
+        self.operator = AsyncRemoteOperator(_Connection())
+        self.delays = []
+        sleep = asyncio.sleep
+
+        async def record(delay):
+            self.delays.append(delay)
+            await sleep(delay)
+
+        patcher = mock.patch('asyncio.sleep', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _wait(self, counts: list, running: bool, timeout: float):
+        counts = iter(counts)
+
+        async def count(process_name_pattern):
+            return next(counts, 1)
+
+        with mock.patch.object(self.operator, '_count_processes', count):
+            return asyncio.run(self.operator._wait_for_processes('app', running=running, timeout=timeout))
+
+    def test_back_off_exponentially(self):
+        self.assertTrue(self._wait([1, 1, 1, 1, 1, 0], running=False, timeout=60))
+        self.assertEqual(self.delays, [0.05, 0.1, 0.2, 0.4, 0.8])
+
+    def test_return_at_once(self):
+        self.assertTrue(self._wait([1], running=True, timeout=60))
+        self.assertEqual(self.delays, [])
+
+    def test_time_out(self):
+        start = time.monotonic()
+        self.assertFalse(self._wait([], running=False, timeout=0.5))
+        # The last sleep is cut short at the deadline
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual(self.delays[:3], [0.05, 0.1, 0.2])
+        self.assertLess(self.delays[-1], 0.4)
+
+    def test_count_processes(self):
+        # The shell running the script is not counted, since the pattern is given through stdin
+        count = asyncio.run(self.operator._count_processes(f'app-{uuid.uuid4().hex}'))
+        self.assertEqual(count, 0)
+
+    def test_raise_after_remote_timeout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.monotonic()
+            with self.assertRaises(OSError) as cm:
+                asyncio.run(self.operator.start_process_with_kill_file(
+                    f'{tmp}/app.kill', f'app-{uuid.uuid4().hex}', 'true', remote_timeout=1,
+                ))
+        self.assertIn('within 1 seconds', str(cm.exception))
+        self.assertLess(time.monotonic() - start, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
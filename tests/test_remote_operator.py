@@ -0,0 +1,713 @@
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+
+import invoke
+import paramiko
+from fabric import Connection
+
+from remote.remote_operator import RemoteOperator
+from remote.ssh_pool import SSHPool
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    """Serves the local file system, enough for the methods used by `RemoteOperator`."""
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        mode = 'r+b' if flags & os.O_RDWR else 'wb' if flags & os.O_WRONLY else 'rb'
+        handle = _SFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        os.replace(oldpath, newpath)
+        return paramiko.SFTP_OK
+
+    def remove(self, path):
+        os.remove(path)
+        return paramiko.SFTP_OK
+
+
+class _Server(paramiko.ServerInterface):
+    """Allows any user, and runs the commands by the local shell with the given environment variables."""
+
+    def __init__(self, env=None):
+        self.env = env
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'none'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def _exec(self, channel, command):
+        process = subprocess.Popen(
+            command, shell=True, env=self.env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+
+        def write_stdin():
+            try:
+                for data in iter(lambda: channel.recv(1 << 16), b''):
+                    process.stdin.write(data)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        def read_stderr():
+            for data in iter(lambda: process.stderr.read1(1 << 16), b''):
+                channel.sendall_stderr(data)
+
+        threads = [threading.Thread(target=write_stdin, daemon=True), threading.Thread(target=read_stderr)]
+        for thread in threads:
+            thread.start()
+        for data in iter(lambda: process.stdout.read1(1 << 16), b''):
+            channel.sendall(data)
+        threads[1].join()
+        channel.send_exit_status(process.wait())
+        channel.close()
+
+
+class _Connection:
+    """Stands for `fabric.connection.Connection` with the transport of a connected socket pair."""
+
+    host_key = paramiko.RSAKey.generate(2048)
+
+    def __init__(self, env=None):
+        client_sock, server_sock = socket.socketpair()
+        self._server = paramiko.Transport(server_sock)
+        self._server.add_server_key(self.host_key)
+        self._server.set_subsystem_handler('sftp', paramiko.SFTPServer, _SFTPServer)
+        started = threading.Thread(target=self._server.start_server, kwargs={'server': _Server(env)})
+        started.start()
+        self.transport = paramiko.Transport(client_sock)
+        self.transport.connect()
+        self.transport.auth_none('deploy')
+        started.join()
+
+    def open(self):
+        pass
+
+    def close(self):
+        self.transport.close()
+        self._server.close()
+
+
+class _LocalConnection:
+    """Stands for `fabric.connection.Connection`, running the commands by the local shell."""
+
+    def __init__(self):
+        self.commands = []
+        self.hides = []
+
+    def run(self, command, warn=False, hide=None, in_stream=None, **kwargs):
+        stdin = in_stream.read() if in_stream else None
+        self.commands.append((command, stdin))
+        self.hides.append(hide)
+        completed = subprocess.run(command, shell=True, input=stdin, capture_output=True, text=True)
+        result = invoke.Result(
+            stdout=completed.stdout, stderr=completed.stderr, exited=completed.returncode, command=command,
+        )
+        if result.failed and not warn:
+            raise invoke.UnexpectedExit(result)
+        return result
+
+    def close(self):
+        pass
+
+
+class _LocalSFTPConnection(_Connection, _LocalConnection):
+    """Stands for `fabric.connection.Connection`, running the commands by the local shell and putting files by SFTP."""
+
+    def __init__(self):
+        _Connection.__init__(self)
+        _LocalConnection.__init__(self)
+
+
+def _local_operator(**kwargs):
+    connection = _LocalConnection()
+    pool = SSHPool('localhost', max_size=1)
+    pool.add(connection)
+    return RemoteOperator(pool, **kwargs), connection
+
+
+class TestQuote(unittest.TestCase):
+
+    def test_keep_home_to_be_expanded(self):
+        self.assertEqual(RemoteOperator._q('~'), '~')
+        self.assertEqual(RemoteOperator._q('~/'), '~/')
+        self.assertEqual(RemoteOperator._q('~/my app'), "~/'my app'")
+        self.assertEqual(RemoteOperator._q('~root'), '~root')
+        self.assertEqual(RemoteOperator._q('~root/.bashrc'), '~root/.bashrc')
+        self.assertEqual(RemoteOperator._q('~deploy-1/app; rm'), "~deploy-1/'app; rm'")
+
+    def test_quote_others(self):
+        self.assertEqual(RemoteOperator._q('/opt/my app'), "'/opt/my app'")
+        self.assertEqual(RemoteOperator._q('app/~'), "'app/~'")
+        self.assertEqual(RemoteOperator._q("~$(rm -rf x)/app"), "'~$(rm -rf x)/app'")
+        self.assertEqual(RemoteOperator._q('~`id`'), "'~`id`'")
+
+    def test_expand_by_shell(self):
+        for path in ['~', '~/my app', '~root/x']:
+            command = f'printf %s {RemoteOperator._q(path)}'
+            completed = subprocess.run(command, shell=True, capture_output=True, text=True)
+            expanded = os.path.expanduser(path)
+            self.assertEqual(completed.stdout, expanded)
+
+
+class TestRunMany(unittest.TestCase):
+
+    def test_log_output_at_info_in_verbose_mode(self):
+        operator, _ = _local_operator(verbose=True)
+        with self.assertLogs('remote.remote_operator', 'INFO') as logs:
+            operator.run_many(['echo shown'])
+        self.assertIn('INFO:remote.remote_operator:shown', logs.output)
+
+    def test_log_output_at_debug(self):
+        operator, _ = _local_operator()
+        with self.assertLogs('remote.remote_operator', 'DEBUG') as logs:
+            operator.run_many(['echo hidden'])
+        self.assertIn('DEBUG:remote.remote_operator:hidden', logs.output)
+
+
+class _NoShellConnection(_LocalConnection):
+    """Stands for a connection to a host of which shell is not found."""
+
+    def run(self, command, **kwargs):
+        return super().run(command.replace('sh -s', 'none-sh -s'), **kwargs)
+
+
+class TestRunSteps(unittest.TestCase):
+
+    def setUp(self):
+        self.operator, _ = _local_operator()
+
+    def test_raise_for_failed_step(self):
+        with self.assertRaises(FileNotFoundError) as cm:
+            self.operator._run_steps([
+                ('true', 'Failed to run true'),
+                ('test -e /none', 'File is not found', FileNotFoundError),
+                ('echo never', 'Failed to echo'),
+            ])
+        self.assertEqual(str(cm.exception), 'File is not found by command: test -e /none')
+
+    def test_continue_after_unchecked_step(self):
+        results = self.operator._run_steps(['false', ('echo after', 'Failed to echo')])
+        self.assertEqual([r.exited for r in results], [0, 0])
+        self.assertEqual(results[1].stdout, 'after\n')
+
+    def test_raise_for_step_which_exits(self):
+        with self.assertRaises(OSError) as cm:
+            self.operator._run_steps([('echo first', 'Failed to echo'), ('exit 3', 'Exited')])
+        self.assertEqual(str(cm.exception), 'Exited by command: exit 3')
+
+    def test_keep_script_from_step_which_reads_stdin(self):
+        results = self.operator._run_steps([('cat', 'Failed to cat'), ('echo after', 'Failed to echo')])
+        self.assertEqual([r.stdout for r in results], ['', 'after\n'])
+
+    def test_raise_if_shell_is_not_found(self):
+        connection = _NoShellConnection()
+        pool = SSHPool('localhost', max_size=1)
+        pool.add(connection)
+        with self.assertRaises(OSError) as cm:
+            RemoteOperator(pool)._run_steps([('test -d /tmp', 'workspace does not exist')])
+        self.assertNotIn('workspace', str(cm.exception))
+        self.assertIn('none-sh', str(cm.exception))
+
+
+class TestBackup(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.app = Path(tmp.name, 'app')
+        self.app.mkdir()
+        Path(self.app, 'app.jar').write_text('new')
+        self.backup = Path(tmp.name, 'backup')
+        Path(self.backup, 'app-20200101').mkdir(parents=True)
+        Path(self.backup, 'app-20200101', 'app.jar').write_text('old')
+        self.operator, self.connection = _local_operator()
+
+    def test_keep_siblings_with_trailing_slash(self):
+        self.operator.backup(f'{self.app}/', str(self.backup))
+        # Whether rsync is installed here or not, it is given the directory itself without --delete
+        script = self.connection.commands[-1][1]
+        self.assertIn(f'then rsync -a {self.app} {self.backup}/;', script)
+        # path_from is copied into path_to as a directory, and the older backup survives
+        self.assertEqual(Path(self.backup, 'app', 'app.jar').read_text(), 'new')
+        self.assertEqual(Path(self.backup, 'app-20200101', 'app.jar').read_text(), 'old')
+        self.assertFalse(Path(self.backup, 'app.jar').exists())
+
+    def test_raise_if_path_from_does_not_exist(self):
+        with self.assertRaises(ValueError):
+            self.operator.backup(f'{self.app}/none', str(self.backup))
+
+
+class TestUpload(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # Files below small_threshold, between it and segment_size, and above segment_size
+        self.local = Path(tmp.name, 'app')
+        Path(self.local, 'my dir', 'sub').mkdir(parents=True)
+        Path(self.local, 'empty').mkdir()
+        Path(self.local, 'app.conf').write_bytes(os.urandom(100))
+        Path(self.local, 'my dir', 'my lib.jar').write_bytes(os.urandom(100 << 10))
+        Path(self.local, 'my dir', 'sub', 'app.jar').write_bytes(os.urandom(600 << 10 | 123))
+        Path(self.local, 'my dir', 'sub', 'small file').write_bytes(os.urandom(10))
+        self.remote = Path(tmp.name, 'remote')
+        self.remote.mkdir()
+        self.connection = _LocalSFTPConnection()
+        self.addCleanup(self.connection.close)
+        pool = SSHPool('localhost', max_size=1)
+        pool.add(self.connection)
+        self.operator = RemoteOperator(
+            pool, sfq_workers=2, lfq_workers=2, small_threshold=64 << 10, segment_size=256 << 10, segment_streams=2,
+        )
+        self.addCleanup(self.operator.close)
+
+    def test_upload_tree(self):
+        self.operator.upload(self.local, str(self.remote))
+
+        uploaded = Path(self.remote, 'app')
+        self.assertEqual(
+            sorted(p.relative_to(uploaded) for p in uploaded.rglob('*')),
+            sorted(p.relative_to(self.local) for p in self.local.rglob('*')),
+        )
+        for path in self.local.rglob('*'):
+            if path.is_file():
+                self.assertEqual(Path(uploaded, path.relative_to(self.local)).read_bytes(), path.read_bytes())
+        self.assertEqual([p for p in self.remote.rglob('*.part*')], [])
+
+        # All of the directories are made by one script
+        scripts = [stdin for command, stdin in self.connection.commands if command == 'sh -s']
+        self.assertEqual(len(scripts), 1)
+        for path in ['app', 'app/my dir', 'app/my dir/sub', 'app/empty']:
+            self.assertIn(shlex.quote(f'{self.remote}/{path}'), scripts[0])
+        self.assertEqual(len(self.connection.commands), 2)
+
+    def test_upload_file(self):
+        local = Path(self.local, 'my dir', 'sub', 'app.jar')
+        self.operator.upload(local, str(self.remote))
+        self.assertEqual(Path(self.remote, 'app.jar').read_bytes(), local.read_bytes())
+        self.assertEqual([p.name for p in self.remote.iterdir()], ['app.jar'])
+
+
+class TestStatCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.operator, self.connection = _local_operator()
+
+    def _probes(self):
+        return [command for command, _ in self.connection.commands if command.startswith('test ')]
+
+    def test_probe_once(self):
+        self.assertTrue(self.operator._remote_isdir(self.tmp))
+        self.assertTrue(self.operator._remote_isdir(self.tmp))
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/none'))
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/none'))
+        self.assertEqual(self._probes(), [f'test -d {self.tmp}', f'test -e {self.tmp}/none'])
+
+    def test_skip_probing_created_directory(self):
+        self.operator.mkdir(f'{self.tmp}/app')
+        self.operator.mkdir(f'{self.tmp}/app')
+        self.assertTrue(self.operator._remote_isdir(f'{self.tmp}/app'))
+        self.assertEqual(len(self.connection.commands), 1)
+
+    def test_probe_again_after_clear_cache(self):
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/app'))
+        Path(self.tmp, 'app').mkdir()
+        self.operator.clear_cache()
+        self.assertTrue(self.operator._remote_exists(f'{self.tmp}/app'))
+        self.assertEqual(len(self._probes()), 2)
+
+    def test_probe_again_after_close(self):
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/app'))
+        Path(self.tmp, 'app').mkdir()
+        self.operator.close()
+        self.assertTrue(self.operator._remote_exists(f'{self.tmp}/app'))
+        self.assertEqual(len(self._probes()), 2)
+
+    def test_forget_backup_destination(self):
+        Path(self.tmp, 'app').mkdir()
+        backup = f'{self.tmp}/backup'
+        self.assertFalse(self.operator._remote_exists(f'{backup}/app'))
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/backup2'))
+        self.operator.backup(f'{self.tmp}/app', backup)
+        self.assertTrue(self.operator._remote_isdir(backup))
+        self.assertTrue(self.operator._remote_exists(f'{backup}/app'))
+        # A sibling of which name starts with the same one is still cached
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/backup2'))
+        self.assertEqual(len(self._probes()), 3)
+
+    def test_forget_backup_destination_if_failed(self):
+        Path(self.tmp, 'app').mkdir()
+        Path(self.tmp, 'file').write_text('not a directory')
+        self.assertTrue(self.operator._remote_exists(f'{self.tmp}/file'))
+        with self.assertRaises(OSError):
+            self.operator.backup(f'{self.tmp}/app', f'{self.tmp}/file')
+        self.assertNotIn(('-e', f'{self.tmp}/file'), self.operator._stat_cache)
+
+    def test_forget_tree_uploaded_by_rsync(self):
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/app'))
+        self.assertFalse(self.operator._remote_exists(f'{self.tmp}/app/lib'))
+        with mock.patch('subprocess.run', return_value=subprocess.CompletedProcess([], 0)):
+            self.operator._rsync_tree(Path('app'), self.tmp, ['ssh'])
+        self.assertEqual(self.operator._stat_cache, {})
+
+
+class TestRsyncTree(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.local = Path(tmp.name, 'app')
+        self.local.mkdir()
+
+    def _upload(self, pool: SSHPool):
+        # Compressed as the pool is, not to make another pool of it
+        operator = RemoteOperator(pool, compress=bool(pool.connect_kwargs.get('compress')))
+        # Not to run `test -d` by the patched `subprocess.run`
+        operator._cache_created('/tmp', is_dir=True)
+        with mock.patch('shutil.which', return_value='/usr/bin/rsync'), \
+                mock.patch.object(operator, '_remote_has_command', return_value=True), \
+                mock.patch.object(operator, '_put_tree') as put_tree, \
+                mock.patch('subprocess.run', return_value=subprocess.CompletedProcess([], 0)) as run:
+            operator.upload_tree(self.local, '/tmp', rsync=True)
+        return run, put_tree
+
+    def test_connect_as_pool(self):
+        gateway = Connection('bastion', user='jump', port=2222, connect_kwargs={'key_filename': '/keys/jump'})
+        pool = SSHPool(
+            'web1', user='deploy', port=22, gateway=gateway, forward_agent=True, connect_timeout=7,
+            connect_kwargs={'key_filename': ['/keys/a', '/keys/b'], 'compress': True}, max_size=1,
+        )
+        run, put_tree = self._upload(pool)
+        put_tree.assert_not_called()
+        command = run.call_args[0][0]
+        self.assertEqual(command[-1], 'deploy@web1:/tmp/')
+        # Compressed only by ssh, not by rsync again
+        self.assertEqual(command[:2], ['rsync', '-a'])
+        rsh = shlex.split(command[command.index('--rsh') + 1])
+        proxy = 'ProxyCommand=ssh -p 2222 -i /keys/jump -W %h:%p jump@bastion'
+        self.assertEqual(rsh, [
+            'ssh', '-p', '22', '-i', '/keys/a', '-i', '/keys/b', '-o', 'ConnectTimeout=7', '-A', '-C',
+            '-o', proxy,
+        ])
+
+    def test_use_gateway_command(self):
+        pool = SSHPool('web1', gateway='nc -X connect -x proxy:3128 %h %p', max_size=1)
+        run, _ = self._upload(pool)
+        command = run.call_args[0][0]
+        rsh = shlex.split(command[command.index('--rsh') + 1])
+        self.assertEqual(rsh, ['ssh', '-o', 'ProxyCommand=nc -X connect -x proxy:3128 %h %p'])
+        self.assertEqual(command[-1], 'web1:/tmp/')
+
+    def test_put_files_if_ssh_cannot_authenticate(self):
+        for pool in [
+            SSHPool('web1', connect_kwargs={'password': 'secret'}, max_size=1),
+            SSHPool('web1', gateway=Connection('bastion', connect_kwargs={'password': 'secret'}), max_size=1),
+        ]:
+            run, put_tree = self._upload(pool)
+            run.assert_not_called()
+            put_tree.assert_called_once()
+
+
+class TestCrontab(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.workspace = Path(tmp.name, 'workspace')
+        self.workspace.mkdir()
+        # `crontab` on host keeps the table in a file
+        self.table = Path(tmp.name, 'table')
+        self.table.write_text('0 * * * * /opt/app/batch.sh\n')
+        bin_path = Path(tmp.name, 'bin')
+        bin_path.mkdir()
+        Path(bin_path, 'crontab').write_text(
+            f'#!/bin/sh\nif [ "$1" = -l ]; then cat {self.table}; else cp "$1" {self.table}; fi\n'
+        )
+        Path(bin_path, 'crontab').chmod(0o755)
+        patcher = mock.patch.dict(os.environ, {'PATH': f'{bin_path}:{os.environ["PATH"]}'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disable_and_enable(self):
+        operator, connection = _local_operator()
+        with operator.disable_crontab(str(self.workspace), 'crontab.save'):
+            self.assertEqual(self.table.read_text(), '')
+        self.assertEqual(self.table.read_text(), '0 * * * * /opt/app/batch.sh\n')
+        self.assertEqual(Path(self.workspace, 'crontab.save').read_text(), '0 * * * * /opt/app/batch.sh\n')
+        # One round-trip to disable and one to enable
+        self.assertEqual(len(connection.commands), 2)
+
+    def test_enable_even_if_task_failed(self):
+        operator, _ = _local_operator()
+        with self.assertRaises(RuntimeError):
+            with operator.disable_crontab(str(self.workspace), 'crontab.save'):
+                raise RuntimeError
+        self.assertEqual(self.table.read_text(), '0 * * * * /opt/app/batch.sh\n')
+
+    def test_raise_if_workspace_does_not_exist(self):
+        operator, connection = _local_operator()
+        with self.assertRaises(OSError) as cm:
+            with operator.disable_crontab(f'{self.workspace}/none', 'crontab.save'):
+                self.fail('The task must not run')
+        self.assertIn('workspace does not exist', str(cm.exception))
+        self.assertEqual(self.table.read_text(), '0 * * * * /opt/app/batch.sh\n')
+        self.assertEqual(len(connection.commands), 1)
+
+    def test_raise_if_file_is_not_found(self):
+        operator, connection = _local_operator()
+        with self.assertRaises(FileNotFoundError):
+            operator.enable_crontab(f'{self.workspace}/none')
+        self.assertEqual(len(connection.commands), 1)
+
+    def test_log_listings_in_verbose_mode(self):
+        operator, connection = _local_operator(verbose=True)
+        with self.assertLogs('remote.remote_operator', 'INFO') as logs:
+            with operator.disable_crontab(str(self.workspace), 'crontab.save'):
+                pass
+        # The saved crontab, and crontab before and after enabling it
+        self.assertEqual(logs.output.count('INFO:remote.remote_operator:0 * * * * /opt/app/batch.sh'), 2)
+        self.assertIn('INFO:remote.remote_operator:Before enabling crontab', logs.output)
+        self.assertIn('INFO:remote.remote_operator:After enabling crontab', logs.output)
+        self.assertEqual(len(connection.commands), 2)
+
+
+class TestKillFile(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.kill_file = f'{tmp.name}/app.kill'
+        # Only the processes of this test have the pattern in their command lines
+        self.pattern = f'app-{uuid.uuid4().hex}'
+        # The application runs until the kill file is created
+        self.app = f'while [ ! -e {self.kill_file} ]; do sleep 0.01; done'
+        self.exec_file = Path(tmp.name, 'start.sh')
+        # Close the outputs, or the shell of `nohup ... &` waits for the application to close them
+        self.exec_file.write_text(f"exec sh -c '{self.app}' {self.pattern} >/dev/null 2>&1 </dev/null\n")
+        self.operator, self.connection = _local_operator()
+
+    def _start_app(self):
+        process = subprocess.Popen(['sh', '-c', self.app, self.pattern])
+        self.addCleanup(process.wait, timeout=5)
+        self.addCleanup(Path(self.kill_file).touch)
+        return process
+
+    def test_stop_soon(self):
+        process = self._start_app()
+        start = time.monotonic()
+        self.operator.stop_process_with_kill_file(self.kill_file, self.pattern)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertIsNotNone(process.poll())
+        self.assertIn(('timeout 60 sh -s', mock.ANY), self.connection.commands)
+
+    def test_skip_stopping_stopped_process(self):
+        self.operator.stop_process_with_kill_file(self.kill_file, self.pattern)
+        self.assertFalse(os.path.exists(self.kill_file))
+        self.assertEqual(len(self.connection.commands), 1)
+
+    def test_raise_if_process_does_not_stop(self):
+        self._start_app()
+        with self.assertRaises(OSError) as cm:
+            # The kill file is in another path than the application watches
+            self.operator.stop_process_with_kill_file(f'{self.kill_file}.other', self.pattern, remote_timeout=1)
+        self.assertIn('within 1 seconds', str(cm.exception))
+
+    def test_start_soon(self):
+        Path(self.kill_file).touch()
+        start = time.monotonic()
+        self.operator.start_process_with_kill_file(self.kill_file, self.pattern, str(self.exec_file))
+        # Wait for the application to stop, before the kill file is removed with the directory
+        self.addCleanup(self.operator.stop_process_with_kill_file, self.kill_file, self.pattern)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.operator._count_processes(self.operator._running_script(self.pattern)), 1)
+
+    def test_log_output_instead_of_printing(self):
+        Path(self.kill_file).touch()
+        with self.assertLogs('remote.remote_operator', 'DEBUG') as logs:
+            self.operator.start_process_with_kill_file(self.kill_file, self.pattern, str(self.exec_file))
+            self.operator.stop_process_with_kill_file(self.kill_file, self.pattern)
+        # Neither the counts nor the removed file go to the console
+        self.assertEqual(set(self.connection.hides), {'out'})
+        self.assertTrue(any(line.startswith('DEBUG:remote.remote_operator:removed') for line in logs.output))
+
+    def test_skip_starting_running_process(self):
+        self._start_app()
+        self.operator.start_process_with_kill_file(self.kill_file, self.pattern, str(self.exec_file))
+        self.assertEqual(len(self.connection.commands), 1)
+
+    def test_raise_if_process_does_not_start(self):
+        start = time.monotonic()
+        with self.assertRaises(OSError) as cm:
+            self.operator.start_process_with_kill_file(self.kill_file, f'{self.pattern}-none', 'true', remote_timeout=1)
+        self.assertIn('within 1 seconds', str(cm.exception))
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_wait_script_backs_off(self):
+        script = self.operator._wait_script(condition='[ -e /none ]')
+        completed = subprocess.run(['timeout', '1', 'sh', '-s', '-x'], input=script, capture_output=True, text=True)
+        self.assertEqual(completed.returncode, 124)
+        delays = [line.split()[-1] for line in completed.stderr.splitlines() if line.startswith('+ sleep')]
+        self.assertEqual(delays[:4], ['0.05', '0.1', '0.2', '0.4'])
+
+
+class TestTarTree(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.local = Path(tmp.name, 'app')
+        self.local.mkdir()
+        self.data = os.urandom(8 << 20)
+        Path(self.local, 'app.jar').write_bytes(self.data)
+        self.remote = Path(tmp.name, 'remote')
+        self.remote.mkdir()
+        # `tar` on host warns a lot before reading the archive, as GNU tar does for archives made on macOS
+        bin_path = Path(tmp.name, 'bin')
+        bin_path.mkdir()
+        tar = shutil.which('tar')
+        Path(bin_path, 'tar').write_text(f'#!/bin/sh\nhead -c {4 << 20} /dev/zero | tr "\\0" w >&2\nexec {tar} "$@"\n')
+        Path(bin_path, 'tar').chmod(0o755)
+        connection = _Connection(env={**os.environ, 'PATH': f'{bin_path}:{os.environ["PATH"]}'})
+        self.addCleanup(connection.close)
+        pool = SSHPool('localhost', max_size=1)
+        pool.add(connection)
+        self.operator = RemoteOperator(pool)
+
+    def _tar_tree(self, remote_path: str):
+        errors = []
+
+        def upload():
+            try:
+                self.operator._tar_tree(self.local, remote_path)
+            except OSError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=upload, daemon=True)
+        thread.start()
+        thread.join(timeout=60)
+        self.assertFalse(thread.is_alive(), 'The upload hung')
+        return errors
+
+    def test_upload_with_many_warnings(self):
+        self.operator._stat_cache[('-e', f'{self.remote}/app')] = False
+        self.assertEqual(self._tar_tree(str(self.remote)), [])
+        # The uploaded tree is probed again
+        self.assertEqual(self.operator._stat_cache, {})
+        self.assertEqual(Path(self.remote, 'app', 'app.jar').read_bytes(), self.data)
+
+    def test_raise_with_the_error_of_tar(self):
+        error, = self._tar_tree(f'{self.remote}/none')
+        self.assertIn('none', str(error))
+        self.assertIn('No such file or directory', str(error))
+
+
+class TestPutResumable(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = _Connection()
+        self.addCleanup(self.connection.close)
+        self.sftp = paramiko.SFTPClient.from_transport(self.connection.transport)
+        self.addCleanup(self.sftp.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.local = Path(tmp.name, 'app.jar')
+        self.local.write_bytes(os.urandom(3 << 20 | 12345))
+        self.remote = f'{tmp.name}/app.jar.remote'
+        self.part = f'{self.remote}.part'
+        self.operator = RemoteOperator(lambda: self.connection, segment_size=256 << 10, segment_streams=4)
+
+    def _put(self):
+        self.operator._put_resumable(self.connection, self.sftp, self.local, self.remote)
+
+    def _source(self):
+        stat = self.local.stat()
+        return f'{stat.st_size} {stat.st_mtime_ns} {256 << 10} 4'
+
+    def _write_part(self, data: bytes, source: str):
+        Path(self.part).write_bytes(data)
+        Path(f'{self.part}.source').write_text(source)
+
+    def test_put_in_many_streams(self):
+        self._put()
+        self.assertEqual(Path(self.remote).read_bytes(), self.local.read_bytes())
+        self.assertFalse(os.path.exists(self.part))
+        self.assertFalse(os.path.exists(f'{self.part}.source'))
+
+    def test_resume_from_the_last_round(self):
+        # The first round of 1 MiB is complete, and the second one stopped midway
+        data = self.local.read_bytes()
+        self._write_part(b'\0' * (1 << 20) + data[1 << 20:(1 << 20) + 1000], self._source())
+        self._put()
+        # The complete round is not written again
+        self.assertEqual(Path(self.remote).read_bytes(), b'\0' * (1 << 20) + data[1 << 20:])
+
+    def test_start_over_for_another_source(self):
+        stat = self.local.stat()
+        self._write_part(b'\0' * (2 << 20), f'{stat.st_size} {stat.st_mtime_ns + 1} {256 << 10} 4')
+        self._put()
+        self.assertEqual(Path(self.remote).read_bytes(), self.local.read_bytes())
+
+    def test_start_over_without_source(self):
+        Path(self.part).write_bytes(b'\0' * (2 << 20))
+        self._put()
+        self.assertEqual(Path(self.remote).read_bytes(), self.local.read_bytes())
+
+    def test_resume_offset(self):
+        round_size = 1 << 20
+        self.assertEqual(RemoteOperator._resume_offset(0, 5 << 20, round_size), 0)
+        self.assertEqual(RemoteOperator._resume_offset(1, 5 << 20, round_size), 0)
+        self.assertEqual(RemoteOperator._resume_offset(round_size, 5 << 20, round_size), 0)
+        self.assertEqual(RemoteOperator._resume_offset(round_size + 1, 5 << 20, round_size), round_size)
+        self.assertEqual(RemoteOperator._resume_offset(3 * round_size, 5 << 20, round_size), 2 * round_size)
+        self.assertEqual(RemoteOperator._resume_offset(5 << 20, 5 << 20, round_size), 4 * round_size)
+        # Larger than the local file, so the partial file is of another file
+        self.assertEqual(RemoteOperator._resume_offset((5 << 20) + 1, 5 << 20, round_size), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import threading
+import unittest
+import uuid
+from unittest import mock
+
+from fabric import Connection
+
+from remote.ssh_pool import SSHPool
+
+
+class _Connection:
+    """Stands for `fabric.connection.Connection` made by the pool, which never connects."""
+
+    def __init__(self, **kwargs):
+        self.settings = kwargs
+
+    def close(self):
+        pass
+
+
+class TestSSHPool(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('fabric.Connection', _Connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_in_thread(self, pool: SSHPool):
+        # Checks out a connection in another thread, and keeps it until `release` is set
+        got, release, connections = threading.Event(), threading.Event(), []
+
+        def get():
+            with pool.get() as connection:
+                connections.append(connection)
+                got.set()
+                release.wait()
+
+        thread = threading.Thread(target=get, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        return got, release, connections
+
+    def test_reuse_the_last_returned(self):
+        pool = SSHPool('web1', max_size=3)
+        with pool.get() as first, pool.get() as second:
+            self.assertIsNot(first, second)
+        # The first one is returned last, since the `with` statement exits in reverse order
+        with pool.get() as connection:
+            self.assertIs(connection, first)
+        with pool.get() as connection, pool.get() as other:
+            self.assertIs(connection, first)
+            self.assertIs(other, second)
+
+    def test_make_connections_with_settings(self):
+        pool = SSHPool('web1', user='deploy', gateway='bastion', connect_timeout=7, max_size=1)
+        with pool.get() as connection:
+            self.assertEqual(connection.settings['host'], 'web1')
+            self.assertEqual(connection.settings['user'], 'deploy')
+            self.assertEqual(connection.settings['gateway'], 'bastion')
+            self.assertEqual(connection.settings['connect_timeout'], 7)
+
+    def test_wait_at_max_size(self):
+        pool = SSHPool('web1', max_size=1)
+        with pool.get() as held:
+            got, release, connections = self._get_in_thread(pool)
+            self.assertFalse(got.wait(0.2))
+        # Returned, so the waiting caller gets it
+        self.assertTrue(got.wait(5))
+        self.assertEqual(connections, [held])
+
+    def test_grow_wakes_waiting_callers(self):
+        pool = SSHPool('web1', max_size=1)
+        with pool.get() as held:
+            got, release, connections = self._get_in_thread(pool)
+            self.assertFalse(got.wait(0.2))
+            pool.grow(2)
+            # A new connection is made while the other one is still held
+            self.assertTrue(got.wait(5))
+            self.assertIsNot(connections[0], held)
+
+    def test_grow_never_shrinks(self):
+        pool = SSHPool('web1', max_size=4)
+        pool.grow(2)
+        self.assertEqual(pool.max_size, 4)
+        with self.assertRaises(ValueError):
+            pool.grow(0)
+
+    def test_share_pool_for_same_settings(self):
+        host = f'web-{uuid.uuid4().hex}'
+        pool = SSHPool.for_connection(Connection(host, gateway='bastion1'), max_size=2)
+        self.assertIs(SSHPool.for_connection(Connection(host, gateway='bastion1'), max_size=5), pool)
+        # Grown to the largest size requested
+        self.assertEqual(pool.max_size, 5)
+        self.assertIsNot(SSHPool.for_connection(Connection(host, gateway='bastion2')), pool)
+        self.assertIsNot(SSHPool.for_connection(Connection(host)), pool)
+
+
+if __name__ == '__main__':
+    unittest.main()